@@ -0,0 +1,427 @@
+"""
+Benchmark suite for nesteddict and dictlistdict.
+
+Benchmarks run against a synthetic document whose shape is controlled by
+`--depth`, `--fanout` and `--leaves`. Results can be saved as JSON and a
+later run compared against them to flag regressions:
+
+    python benchmark.py run --output baseline.json
+    python benchmark.py run --output current.json
+    python benchmark.py compare baseline.json current.json
+
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import dictlistdict
+from nesteddict import NestedDict, CompactNestedDict
+
+HIGHER_IS_BETTER = "ops/s"
+LOWER_IS_BETTER = "bytes"
+
+
+def generate_paths(depth=4, fanout=5, leaves=10000):
+    """
+    Return `leaves` dotted keys for a tree `depth` levels deep with `fanout`
+    children per intermediate level. The keys are spread evenly across the
+    intermediate levels so the tree is as sparse as `leaves` allows.
+
+    >>> generate_paths(depth=2, fanout=2, leaves=3)
+    ['n0.k0', 'n1.k1', 'n0.k2']
+    """
+    paths = []
+    for i in range(leaves):
+        parents = []
+        n = i
+        for _ in range(depth - 1):
+            parents.append(f"n{n % fanout}")
+            n = n // fanout
+        paths.append(".".join(parents + [f"k{i}"]))
+    return paths
+
+
+def generate_document(depth=4, fanout=5, leaves=10000):
+    """
+    Return a flat dict of dotted keys to leaf values. The values cycle
+    through the JSON leaf types.
+    """
+    values = ["some text", 42, -3.5, True, False, None]
+    return {p: values[i % len(values)]
+            for i, p in enumerate(generate_paths(depth, fanout, leaves))}
+
+
+def generate_records(leaves=10000, fields=("name", "age", "email", "active")):
+    """
+    Return a flat dict of record-shaped data: `leaves` values split into
+    records of `fields` under ten regions. This is the shape
+    `CompactNestedDict` is designed for.
+
+    >>> generate_records(leaves=4, fields=("a", "b"))
+    {'region0.user0.a': 0, 'region0.user0.b': 0, 'region1.user1.a': 1, 'region1.user1.b': 1}
+    """
+    return {f"region{i % 10}.user{i}.{f}": i
+            for i in range(leaves // len(fields)) for f in fields}
+
+
+def best_of(fn, repeat):
+    """Return the shortest of `repeat` timings of `fn()` in seconds."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def bench_get(flat, repeat):
+    d = NestedDict(flat)
+    keys = list(flat)
+
+    def run():
+        for k in keys:
+            d[k]
+    return len(keys) / best_of(run, repeat)
+
+
+def bench_get_instrumented(flat, repeat):
+    d = NestedDict(flat).instrument()
+    keys = list(flat)
+
+    def run():
+        for k in keys:
+            d[k]
+    return len(keys) / best_of(run, repeat)
+
+
+def bench_view_get(flat, repeat):
+    """Reads per second through `view()` of each key's parent."""
+    d = NestedDict(flat)
+    pairs = [tuple(k.rsplit('.', 1)) for k in flat]
+
+    def run():
+        for prefix, k in pairs:
+            d.view(prefix)[k]
+    return len(pairs) / best_of(run, repeat)
+
+
+def bench_set(flat, repeat):
+    d = NestedDict(flat)
+    items = list(flat.items())
+
+    def run():
+        for k, v in items:
+            d[k] = v
+    return len(items) / best_of(run, repeat)
+
+
+def bench_contains(flat, repeat):
+    d = NestedDict(flat)
+    keys = list(flat)
+
+    def run():
+        for k in keys:
+            k in d
+    return len(keys) / best_of(run, repeat)
+
+
+def bench_delete(flat, repeat):
+    keys = list(flat)
+    best = None
+    for _ in range(repeat):
+        d = NestedDict(flat)
+        start = time.perf_counter()
+        for k in keys:
+            del d[k]
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return len(keys) / best
+
+
+def bench_init(flat, repeat):
+    return len(flat) / best_of(lambda: NestedDict(flat), repeat)
+
+
+def bench_from_flat(flat, repeat):
+    return len(flat) / best_of(lambda: NestedDict.from_flat(flat, processes=1), repeat)
+
+
+def bench_update(flat, repeat):
+    d = NestedDict()
+    return len(flat) / best_of(lambda: d.update(flat), repeat)
+
+
+def bench_flatten_dict(flat, repeat):
+    d = NestedDict(flat)
+    return len(flat) / best_of(lambda: list(dictlistdict.flatten_dict(d)), repeat)
+
+
+def bench_iter_leaves_sorted(flat, repeat):
+    d = NestedDict(flat)
+    return len(flat) / best_of(lambda: list(d.iter_leaves(sorted=True)), repeat)
+
+
+def bench_json_to_text(flat, repeat):
+    with tempfile.TemporaryDirectory() as tmp:
+        input_filename = os.path.join(tmp, "bench.json")
+        output_filename = os.path.join(tmp, "bench.txt")
+        with open(input_filename, "w", encoding="Latin-1") as input_file:
+            json.dump(NestedDict(flat), input_file)
+        elapsed = best_of(lambda: dictlistdict.json_to_text(input_filename, output_filename),
+                          repeat)
+    return len(flat) / elapsed
+
+
+def bench_text_to_json(flat, repeat):
+    with tempfile.TemporaryDirectory() as tmp:
+        input_filename = os.path.join(tmp, "bench.txt")
+        output_filename = os.path.join(tmp, "bench.json")
+        with open(input_filename, "w", encoding="Latin-1") as input_file:
+            for line in dictlistdict.flatten_dict(NestedDict(flat)):
+                input_file.write(f"{line}\n")
+        elapsed = best_of(lambda: dictlistdict.text_to_json(input_filename, output_filename),
+                          repeat)
+    return len(flat) / elapsed
+
+
+def bench_parse_value(flat, repeat):
+    values = [dictlistdict.format_value(v) for v in flat.values()]
+
+    def run():
+        for v in values:
+            dictlistdict.parse_value(v)
+    return len(values) / best_of(run, repeat)
+
+
+def bench_get_40_keys(flat, repeat, fields=40):
+    """Documents per second read with 40 `__getitem__` calls, the baseline
+    for `compile_schema`."""
+    paths = list(flat)[:fields]
+    d = NestedDict(flat)
+    documents = 1000
+
+    def run():
+        for _ in range(documents):
+            tuple(d[p] for p in paths)
+    return documents / best_of(run, repeat)
+
+
+def bench_compile_schema(flat, repeat, fields=40):
+    """Documents per second read through a 40 key `CompiledSchema`."""
+    paths = list(flat)[:fields]
+    d = NestedDict(flat)
+    schema = NestedDict.compile_schema(paths)
+    documents = 1000
+
+    def run():
+        for _ in range(documents):
+            schema(d)
+    return documents / best_of(run, repeat)
+
+
+def bench_derived(flat, repeat):
+    """Reads per second of a cached `${...}` template over two keys."""
+    d = NestedDict(flat)
+    keys = list(flat)[:2]
+    d.derive_template("t", f"${{{keys[0]}}}:${{{keys[1]}}}")
+    reads = 100000
+
+    def run():
+        for _ in range(reads):
+            d.derived("t")
+    return reads / best_of(run, repeat)
+
+
+def bench_memory(cls, records=False):
+    """
+    Bytes allocated building `cls` from the generated document, or from
+    `generate_records` with as many leaves when `records` is True.
+    """
+    def run(flat, repeat):
+        if records:
+            flat = generate_records(len(flat))
+        tracemalloc.start()
+        tree = cls(flat)
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del tree
+        return size
+    return run
+
+
+BENCHMARKS = {
+    "get": (bench_get, HIGHER_IS_BETTER),
+    "get_instrumented": (bench_get_instrumented, HIGHER_IS_BETTER),
+    "view_get": (bench_view_get, HIGHER_IS_BETTER),
+    "set": (bench_set, HIGHER_IS_BETTER),
+    "contains": (bench_contains, HIGHER_IS_BETTER),
+    "delete": (bench_delete, HIGHER_IS_BETTER),
+    "init": (bench_init, HIGHER_IS_BETTER),
+    "from_flat": (bench_from_flat, HIGHER_IS_BETTER),
+    "update": (bench_update, HIGHER_IS_BETTER),
+    "flatten_dict": (bench_flatten_dict, HIGHER_IS_BETTER),
+    "iter_leaves_sorted": (bench_iter_leaves_sorted, HIGHER_IS_BETTER),
+    "json_to_text": (bench_json_to_text, HIGHER_IS_BETTER),
+    "text_to_json": (bench_text_to_json, HIGHER_IS_BETTER),
+    "parse_value": (bench_parse_value, HIGHER_IS_BETTER),
+    "get_40_keys": (bench_get_40_keys, HIGHER_IS_BETTER),
+    "compile_schema": (bench_compile_schema, HIGHER_IS_BETTER),
+    "derived": (bench_derived, HIGHER_IS_BETTER),
+    "memory_nesteddict": (bench_memory(NestedDict), LOWER_IS_BETTER),
+    "memory_compact": (bench_memory(CompactNestedDict), LOWER_IS_BETTER),
+    "memory_records_nesteddict": (bench_memory(NestedDict, records=True), LOWER_IS_BETTER),
+    "memory_records_compact": (bench_memory(CompactNestedDict, records=True), LOWER_IS_BETTER),
+}
+
+
+def run_benchmarks(names=None, depth=4, fanout=5, leaves=10000, repeat=3):
+    """
+    Run the benchmarks in `names` (all of them by default) and return a
+    dict suitable for saving with `json.dump`.
+    """
+    names = names or list(BENCHMARKS)
+    flat = generate_document(depth, fanout, leaves)
+    results = {}
+    for name in names:
+        if name not in BENCHMARKS:
+            raise ValueError(f"no such benchmark: {name}")
+        fn, unit = BENCHMARKS[name]
+        results[name] = {"value": fn(flat, repeat), "unit": unit}
+    return {
+        "created": datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "params": {"depth": depth, "fanout": fanout, "leaves": leaves, "repeat": repeat},
+        "results": results,
+    }
+
+
+def compare_results(baseline, current, threshold=0.10):
+    """
+    Compare two result sets from `run_benchmarks`. Return a list of
+    `(name, baseline_value, current_value, change, regressed)` tuples where
+    `change` is the relative change in the "better" direction, so a
+    negative number is always a slowdown or a larger footprint.
+    """
+    rows = []
+    for name, entry in current["results"].items():
+        if name not in baseline["results"]:
+            continue
+        old = baseline["results"][name]["value"]
+        new = entry["value"]
+        if not old:
+            continue
+        if entry["unit"] == LOWER_IS_BETTER:
+            change = (old - new) / old
+        else:
+            change = (new - old) / old
+        rows.append((name, old, new, change, change < -threshold))
+    return rows
+
+
+def crossover(sizes=(10000, 100000, 250000, 500000, 1000000, 2000000),
+              depth=4, fanout=20, processes=None, repeat=1):
+    """
+    Time `NestedDict(flat)` and `NestedDict.from_flat` in and out of
+    process for each input size in `sizes`. Return a list of
+    `(size, init, serial, parallel)` timings in seconds.
+    """
+    rows = []
+    for size in sizes:
+        flat = generate_document(depth, fanout, size)
+        init = best_of(lambda: NestedDict(flat), repeat)
+        serial = best_of(lambda: NestedDict.from_flat(flat, processes=1), repeat)
+        parallel = best_of(lambda: NestedDict.from_flat(flat, processes=processes,
+                                                        threshold=0), repeat)
+        rows.append((size, init, serial, parallel))
+    return rows
+
+
+def print_results(results):
+    params = results["params"]
+    print(f"depth={params['depth']} fanout={params['fanout']} leaves={params['leaves']} "
+          f"({results['implementation']} {results['python']})")
+    for name, entry in results["results"].items():
+        print(f"{name:26}: {entry['value']:14,.0f} {entry['unit']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command")
+
+    run = commands.add_parser("run", help="run the benchmarks")
+    run.add_argument("names", nargs="*", help=f"benchmarks to run [default: all] "
+                                              f"choices: {', '.join(BENCHMARKS)}")
+    run.add_argument("--depth", type=int, default=4,
+                     help="levels in the generated document [default: %(default)s]")
+    run.add_argument("--fanout", type=int, default=5,
+                     help="children per intermediate level [default: %(default)s]")
+    run.add_argument("--leaves", type=int, default=10000,
+                     help="number of leaf values [default: %(default)s]")
+    run.add_argument("--repeat", type=int, default=3,
+                     help="take the best of this many runs [default: %(default)s]")
+    run.add_argument("--output", default=None, help="save the results to this JSON file")
+
+    compare = commands.add_parser("compare", help="compare results against a baseline")
+    compare.add_argument("baseline", help="JSON results to compare against")
+    compare.add_argument("current", help="JSON results of the new run")
+    compare.add_argument("--threshold", type=float, default=0.10,
+                         help="relative change treated as a regression [default: %(default)s]")
+
+    cross = commands.add_parser("crossover",
+                                help="find the input size where from_flat should use processes")
+    cross.add_argument("sizes", nargs="*", type=int,
+                       default=[10000, 100000, 250000, 500000, 1000000, 2000000],
+                       help="numbers of keys to try [default: %(default)s]")
+    cross.add_argument("--processes", type=int, default=None,
+                       help="worker processes [default: os.cpu_count()]")
+
+    args = parser.parse_args()
+
+    if args.command == "run":
+        results = run_benchmarks(args.names, depth=args.depth, fanout=args.fanout,
+                                 leaves=args.leaves, repeat=args.repeat)
+        print_results(results)
+        if args.output:
+            with open(args.output, "w") as output_file:
+                json.dump(results, output_file, indent=2)
+                output_file.write("\n")
+    elif args.command == "compare":
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        with open(args.current) as current_file:
+            current = json.load(current_file)
+        if baseline["params"] != current["params"]:
+            print(f"Warning: parameters differ {baseline['params']} != {current['params']}")
+        regressions = 0
+        for name, old, new, change, regressed in compare_results(baseline, current,
+                                                                 args.threshold):
+            flag = "REGRESSION" if regressed else ""
+            print(f"{name:26}: {old:14,.0f} -> {new:14,.0f} {change:+8.1%} {flag}")
+            regressions = regressions + regressed
+        if regressions:
+            sys.exit(1)
+    elif args.command == "crossover":
+        found = None
+        print(f"{'keys':>10} {'init':>8} {'serial':>8} {'parallel':>8}")
+        for size, init, serial, parallel in crossover(args.sizes, processes=args.processes):
+            print(f"{size:10,d} {init:8.3f} {serial:8.3f} {parallel:8.3f}")
+            if found is None and parallel < serial:
+                found = size
+        if found is None:
+            print("The process pool was never faster than building in process")
+        else:
+            print(f"Crossover at about {found:,d} keys")
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -28,38 +28,200 @@ class GenerateName:
             return self._name
         
     
-def flatten_dict(d, prv_keys=[], sep="."):
+def format_value(v):
+    """
+    Render a leaf value as a typed literal so that `parse_value` can
+    recover the original JSON type. Strings are always quoted, numbers,
+    booleans and nulls are written bare in their JSON spelling.
+
+    >>> format_value("abc")
+    '"abc"'
+    >>> format_value(1), format_value(1.5), format_value(True), format_value(None)
+    ('1', '1.5', 'true', 'null')
+    """
+    if isinstance(v, str):
+        return json.dumps(v, ensure_ascii=False)
+    if v is True:
+        return "true"
+    if v is False:
+        return "false"
+    if v is None:
+        return "null"
+    if isinstance(v, int):
+        return str(v)
+    return json.dumps(v, ensure_ascii=False)
+
+
+def parse_value(text):
+    """
+    Parse a typed literal written by `format_value`. Dispatches on the
+    first character so each value is scanned once. Anything that cannot
+    be read as a literal is returned as a plain string with surrounding
+    quotes removed, which keeps files written by older versions readable.
+
+    >>> parse_value('"abc"'), parse_value('12'), parse_value('-1.5e3')
+    ('abc', 12, -1500.0)
+    >>> parse_value('true'), parse_value('false'), parse_value('null')
+    (True, False, None)
+    >>> parse_value('[1, 2]')
+    [1, 2]
+    >>> parse_value('plain text')
+    'plain text'
+    """
+    if not text:
+        return text
+    c = text[0]
+    if c == '"':
+        if len(text) > 1 and text[-1] == '"':
+            body = text[1:-1]
+            if "\\" not in body and '"' not in body:
+                return body
+            try:
+                return json.loads(text)
+            except ValueError:
+                pass
+        return text.strip('"')
+    if c in "-0123456789IN":
+        if c not in "IN" and "." not in text and "e" not in text and "E" not in text:
+            try:
+                return int(text)
+            except ValueError:
+                pass
+        try:
+            return float(text)
+        except ValueError:
+            return text
+    if c == "t" and text == "true":
+        return True
+    if c == "f" and text == "false":
+        return False
+    if c == "n" and text == "null":
+        return None
+    if c == "[" or c == "{":
+        try:
+            return json.loads(text)
+        except ValueError:
+            return text
+    return text
 
+
+def flatten_items(d, prv_keys=()):
+    """
+    Yield a `(keys, value)` pair for every leaf in `d` where `keys` is a
+    tuple of the key segments leading to the leaf.
+    """
     for k, v in d.items():
-        if isinstance(v, dict):
-            yield from flatten_dict(v, prv_keys + [k], sep)
+        if isinstance(v, dict) and v:
+            yield from flatten_items(v, (*prv_keys, k))
         else:
-            yield f"{sep.join(prv_keys + [k])}=\"{v}\""
+            yield (*prv_keys, k), v
+
+
+def flatten_dict(d, prv_keys=[], sep="."):
 
+    for keys, v in flatten_items(d, prv_keys):
+        yield f"{sep.join(keys)}={format_value(v)}"
 
-def json_to_text(input_filename, output_filename=None, encoding="Latin-1", separator="."):
+
+def compress_dict(d, sep="."):
+    """
+    Like `flatten_dict` but each key may be written relative to the parent
+    of the previous key. A key starting with n separators keeps all but the
+    last n - 1 segments of the previous parent and appends the rest.
+
+    >>> d = {"user": {"name": {"first": "a", "last": "b"}, "age": 3}, "id": 4}
+    >>> for line in compress_dict(d):
+    ...     print(line)
+    user.name.first="a"
+    .last="b"
+    ..age=3
+    id=4
+    """
+    prev_parent = ()
+    for keys, v in flatten_items(d):
+        if keys[0] == "":
+            raise ValueError(f"cannot compress key with empty first segment: {keys}")
+        parent = keys[:-1]
+        shared = 0
+        for a, b in zip(parent, prev_parent):
+            if a != b:
+                break
+            shared = shared + 1
+        full = sep.join(keys)
+        key = full
+        # a relative key whose first new segment is empty would start with
+        # one separator too many and be read as a step up
+        if shared and keys[shared] != "":
+            relative = sep * (len(prev_parent) - shared + 1) + sep.join(keys[shared:])
+            if len(relative) < len(full):
+                key = relative
+        prev_parent = parent
+        yield f"{key}={format_value(v)}"
+
+
+def expand_key(key, prev_parent, sep="."):
+    """
+    Resolve a key written by `compress_dict` against the parent segments of
+    the previous key. Keys without a leading separator are returned split.
+
+    >>> expand_key("..e", ("a", "b"))
+    ['a', 'e']
+    """
+    n = 0
+    pos = 0
+    while key.startswith(sep, pos):
+        n = n + 1
+        pos = pos + len(sep)
+    if n == 0:
+        return key.split(sep)
+    kept = len(prev_parent) - (n - 1)
+    if kept < 0:
+        raise ValueError(f"{key} refers above the top level")
+    return list(prev_parent[:kept]) + key[pos:].split(sep)
+
+
+def json_to_text(input_filename, output_filename=None, encoding="Latin-1", separator=".",
+                 compress=False):
+    flatten = compress_dict if compress else flatten_dict
     with open(input_filename, "r", encoding=encoding) as input_file:
         input_dict = json.load(input_file)
         if output_filename:
             with open(output_filename, "w", encoding=encoding) as output_file:
                 output_file.write(f"# Created '{output_filename}' at UTC: {datetime.utcnow()}\n")
-                for line in flatten_dict(d=input_dict, prv_keys=[], sep=separator):
+                for line in flatten(input_dict, sep=separator):
                     output_file.write(f"{line}\n")
         else:
-            for line in flatten_dict(d=input_dict, prv_keys=[], sep=separator):
+            for line in flatten(input_dict, sep=separator):
                 print(line)
 
 
-def text_to_json(input_filename, output_filename=None, encoding="Latin-1", separator="."):
+def read_text(input_filename, encoding="Latin-1", separator=".", compress=False):
+    """
+    Read a file written by `json_to_text` into a NestedDict. Key segments
+    are interned so a segment repeated on many lines is stored once.
+    """
     r = nesteddict.NestedDict()
+    intern = sys.intern
+    prev_parent = ()
     with open(input_filename, "r", encoding=encoding) as input_file:
-        for line in input_file.readlines():
+        for line in input_file:
             line = line.strip()
-            if line.startswith("#"):
+            if not line or line.startswith("#"):
                 continue
             key, _, value = line.partition("=")
-            value = value.strip()
-            r[key] = value.strip('"')
+            if compress:
+                keys = expand_key(key, prev_parent, separator)
+            else:
+                keys = key.split(separator)
+            keys = [intern(k) for k in keys]
+            prev_parent = keys[:-1]
+            r._set_nested(r, keys, parse_value(value.strip()))
+    return r
+
+
+def text_to_json(input_filename, output_filename=None, encoding="Latin-1", separator=".",
+                 compress=False):
+    r = read_text(input_filename, encoding=encoding, separator=separator, compress=compress)
 
     if output_filename:
         with open(output_filename, "w", encoding=encoding) as output_file:
@@ -69,16 +231,18 @@ def text_to_json(input_filename, output_filename=None, encoding="Latin-1", separ
         print(json.dumps(r, indent=2))
 
 
-def json_to_text_args(files, ext, encoding, separator):
+def json_to_text_args(files, ext, encoding, separator, compress=False):
     for f in files:
         namegen = GenerateName(f, ext)
-        json_to_text(f, output_filename=namegen.name(), encoding=encoding, separator=separator)
+        json_to_text(f, output_filename=namegen.name(), encoding=encoding, separator=separator,
+                     compress=compress)
 
 
-def text_to_json_args(files, ext, encoding, separator):
+def text_to_json_args(files, ext, encoding, separator, compress=False):
     for f in files:
         namegen = GenerateName(f, ext)
-        text_to_json(f, output_file=namegen.name(), encoding=encoding, separator=separator)
+        text_to_json(f, output_filename=namegen.name(), encoding=encoding, separator=separator,
+                     compress=compress)
 
 def iterate_args(files, output_filename, encoding, separator):
     for f in files:
@@ -100,6 +264,8 @@ def main():
                         help="Encoding for read and write streams [default: %(default)s]")
     parser.add_argument('--ext', default=None,
                         help="send output to a corresponding file with this extension")
+    parser.add_argument('--compress', default=False, action="store_true",
+                        help="write (or read) keys relative to the previous line's prefix")
     args = parser.parse_args()
 
     output_file = None
@@ -112,13 +278,15 @@ def main():
         json_to_text_args(files=args.jsontotext,
                           ext=args.ext,
                           encoding=args.encoding,
-                          separator=args.separator)
+                          separator=args.separator,
+                          compress=args.compress)
 
     if args.texttojson:
         text_to_json_args(files=args.texttojson,
                           ext=args.ext,
                           encoding=args.encoding,
-                          separator=args.separator)
+                          separator=args.separator,
+                          compress=args.compress)
 
 
 if __name__ == "__main__":
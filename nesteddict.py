@@ -1,3 +1,126 @@
+import os
+import re
+import sys
+import time
+from bisect import bisect_left, bisect_right
+from collections import Counter, OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from collections.abc import Mapping, MutableMapping
+
+_MISSING = object()
+
+# Number of keys below which `NestedDict.from_flat` builds in the calling
+# process. Pickling the partitions to and from the workers costs more than
+# the build itself for smaller inputs. Re-measure on the target machine with
+# `python benchmark.py crossover`.
+PARALLEL_THRESHOLD = 1000000
+
+# Number of derived values each NestedDict keeps, see `NestedDict.derive`.
+MEMO_MAXSIZE = 128
+
+_TEMPLATE_REFERENCE = re.compile(r"\$\{([^}]+)\}")
+
+
+class CompiledSchema:
+    """
+    A precompiled accessor for a fixed set of dotted keys. The keys are
+    merged into a single traversal plan so that shared prefixes are only
+    walked once per document. Use `NestedDict.compile_schema` to create one.
+
+    >>> schema = NestedDict.compile_schema(["a.b.c", "a.b.d", "x"])
+    >>> schema({"a": {"b": {"c": 1, "d": 2}}, "x": 3})
+    Record(a_b_c=1, a_b_d=2, x=3)
+    >>> schema({"a": {"b": {"c": 1}}, "x": 3})
+    Traceback (most recent call last):
+    KeyError: 'no such key: a.b.d'
+
+    """
+
+    def __init__(self, paths, types=None, defaults=None):
+        """
+        :param paths: an iterable of dotted keys e.g. ["a.b.c", "x.y"]
+        :param types: optional dict mapping a dotted key to a type or tuple
+            of types. The extracted value must be an instance of it.
+        :param defaults: optional dict mapping a dotted key to the value
+            used when the key is missing. Keys without a default are required.
+        """
+        self._paths = tuple(paths)
+        for p in self._paths:
+            if not isinstance(p, str):
+                raise ValueError(f"{p} is not a string type")
+        if len(set(self._paths)) != len(self._paths):
+            raise ValueError("duplicate keys in schema")
+        self._types = dict(types or {})
+        self._defaults = dict(defaults or {})
+        for p in list(self._types) + list(self._defaults):
+            if p not in self._paths:
+                raise ValueError(f"{p} is not a key in this schema")
+        self._checks = tuple((i, p, self._types[p])
+                             for i, p in enumerate(self._paths) if p in self._types)
+        self._plan = self._compile()
+        self.Record = namedtuple("Record",
+                                 [p.replace(".", "_") for p in self._paths],
+                                 rename=True)
+
+    @property
+    def paths(self):
+        """The dotted keys in the order they appear in each record"""
+        return self._paths
+
+    def _compile(self):
+        """
+        Build a tree of `(key, index, children)` nodes where `index` is the
+        slot in the output record for the key (or None when the node is only
+        a shared prefix) and `children` are the nodes below it.
+        """
+        root = {}
+        for index, path in enumerate(self._paths):
+            node = root
+            keys = path.split('.')
+            for k in keys[:-1]:
+                node = node.setdefault(k, [None, {}])[1]
+            node.setdefault(keys[-1], [None, {}])[0] = index
+
+        def freeze(node):
+            return tuple((k, index, freeze(children))
+                         for k, (index, children) in node.items())
+
+        return freeze(root)
+
+    def _walk(self, d, plan, out):
+        for key, index, children in plan:
+            if _is_node(d) and _node_has(d, key):
+                v = _node_get(d, key)
+                if index is not None:
+                    out[index] = v
+                if children:
+                    self._walk(v, children, out)
+
+    def extract(self, d):
+        """
+        Extract every key of the schema from `d` in a single walk.
+
+        :param d: a dict or NestedDict
+        :return: a `Record` namedtuple with one field per key
+        """
+        out = [_MISSING] * len(self._paths)
+        self._walk(d, self._plan, out)
+        for i, v in enumerate(out):
+            if v is _MISSING:
+                path = self._paths[i]
+                if path in self._defaults:
+                    out[i] = self._defaults[path]
+                else:
+                    raise KeyError(f"no such key: {path}")
+        for i, path, expected in self._checks:
+            if not isinstance(out[i], expected):
+                raise TypeError(f"{path}: expected {expected}, "
+                                f"got {type(out[i]).__name__}")
+        return self.Record._make(out)
+
+    __call__ = extract
+
+
 class NestedDict(dict):
     """
 
@@ -23,6 +146,19 @@ class NestedDict(dict):
 
     """
 
+    _sort_cache = None  # a _SortCache once a sorted scan has been made
+    _memo = None  # a Memo once a derived value has been registered
+
+    def __getstate__(self):
+        """
+        Leave the sort cache and derived values out of copies and pickles,
+        they belong to this instance and derived functions are often
+        lambdas that cannot be pickled.
+        """
+        state = {k: v for k, v in self.__dict__.items()
+                 if k not in ("_sort_cache", "_memo")}
+        return state or None
+
     def _key_split(self, key):
         """
         Split a key into its component parts
@@ -52,11 +188,11 @@ class NestedDict(dict):
         """
         if len(keys) > 1 and isinstance(d, dict):
             if dict.__contains__(d, keys[0]):
-                return self._has_nested(d[keys[0]], keys[1:])
+                return self._has_nested(dict.__getitem__(d, keys[0]), keys[1:])
             else:
                 return False
         else:
-            return dict.__contains__(d, keys[0])
+            return isinstance(d, dict) and dict.__contains__(d, keys[0])
 
     def _get_nested(self, d, keys):
         """
@@ -73,8 +209,8 @@ class NestedDict(dict):
         {'c': 1}
         """
         if len(keys) > 1 and isinstance(d, dict):
-            if dict(d).__contains__(keys[0]):
-                return self._get_nested(d[keys[0]], keys[1:])
+            if dict.__contains__(d, keys[0]):
+                return self._get_nested(dict.__getitem__(d, keys[0]), keys[1:])
             else:
                 raise KeyError(f"no such key: {keys[0]}")
         else:
@@ -99,24 +235,26 @@ class NestedDict(dict):
 
         """
         if len(keys) > 1 and isinstance(d, dict):
-            if dict(d).__contains__(keys[0]) and isinstance(d[keys[0]], dict):
-                return self._set_nested(d[keys[0]], keys[1:], value)
+            if dict.__contains__(d, keys[0]) and isinstance(dict.__getitem__(d, keys[0]), dict):
+                return self._set_nested(dict.__getitem__(d, keys[0]), keys[1:], value)
             else:
-                d[keys[0]] = {}
-                return self._set_nested(d[keys[0]], keys[1:], value)
+                child = {}
+                dict.__setitem__(d, keys[0], child)
+                return self._set_nested(child, keys[1:], value)
         else:
             dict.__setitem__(d, keys[0], value)
 
     def _del_nested(self, d, keys):
         if len(keys) > 1 and isinstance(d, dict):
-            if dict(d).__contains__(keys[0]):
-                return self._del_nested(d[keys[0]], keys[1:])
+            if dict.__contains__(d, keys[0]):
+                return self._del_nested(dict.__getitem__(d, keys[0]), keys[1:])
             else:
                 dict.__delitem__(d, keys[0])
         else:
             dict.__delitem__(d, keys[0])
 
     def _apply_init(self, seq, **kwargs):
+        self._invalidate()
         if seq is None:
             self={}
         elif isinstance(seq, dict):
@@ -178,7 +316,12 @@ class NestedDict(dict):
         """Set key to value where key can be dotted notation e.g. 'a.b.c'"""
         if not isinstance(key, str):
             raise ValueError(f"{key} is not a string type")
-        self._set_nested(self, key.split('.'), value)
+        keys = key.split('.')
+        changed_from = 0
+        if self._sort_cache is not None and self._has_nested(self, keys):
+            changed_from = len(keys)
+        self._set_nested(self, keys, value)
+        self._invalidate(keys, changed_from)
 
     def get(self, key, default_value=None):
         """Return key or if key not present return `default_value`"""
@@ -202,7 +345,9 @@ class NestedDict(dict):
         """Remove key from collection"""
         if not isinstance(key, str):
             raise ValueError(f"{key} is not a string type")
-        self._del_nested(self, key.split('.'))
+        keys = key.split('.')
+        self._del_nested(self, keys)
+        self._invalidate(keys, len(keys) - 1)
 
     def pop(self, key, default_value=None):
         """Remove key and return value associated with key. if key not present
@@ -211,7 +356,7 @@ class NestedDict(dict):
             raise ValueError(f"{key} is not a string type")
         try:
             v = self._get_nested(self, key.split('.'))
-            self._del_nested(self, key.split('.'))
+            self.__delitem__(key)
         except KeyError:
             v = default_value
 
@@ -222,9 +367,357 @@ class NestedDict(dict):
         if not isinstance(key, str):
             raise ValueError(f"{key} is not a string type")
         v = self._get_nested(self, key.split('.'))
-        self._del_nested(self, key.split('.'))
+        self.__delitem__(key)
         return key, v
 
+    def _invalidate(self, keys=None, changed_from=0):
+        """
+        Tell the sort cache and the derived value cache that `keys` has
+        been written, or with no `keys` that the whole tree has been
+        replaced. Every write through this NestedDict ends here, writes
+        made directly to inner dicts do not.
+        """
+        if keys is None:
+            if self._sort_cache is not None:
+                self._sort_cache = None
+            if self._memo is not None:
+                self._memo.clear()
+            return
+        if self._sort_cache is not None:
+            self._invalidate_sorted(keys, changed_from)
+        if self._memo is not None:
+            self._memo.invalidate(keys)
+
+    def _invalidate_sorted(self, keys, changed_from=0):
+        """
+        Drop the cached child orders that a write to `keys` can change: the
+        subtree below `keys` and the ancestors from depth `changed_from`
+        down, whose sets of child keys may change.
+        """
+        entry = self._sort_cache
+        for depth, k in enumerate(keys):
+            if depth >= changed_from:
+                entry.keys = None
+            if depth == len(keys) - 1:
+                entry.children.pop(k, None)
+                return
+            entry = entry.children.get(k)
+            if entry is None:
+                return
+
+    def _sorted_children(self, node, path, refresh=False):
+        """
+        Return the sorted keys of `node`, the node at `path`, caching the
+        result until a write through this NestedDict changes them, the
+        number of keys in `node` changes, or `refresh` is True.
+        """
+        entry = self._sort_cache
+        if entry is None:
+            entry = self._sort_cache = _SortCache()
+        for k in path:
+            child = entry.children.get(k)
+            if child is None:
+                child = entry.children[k] = _SortCache()
+            entry = child
+        if entry.node is not node:
+            entry.node = node
+            entry.keys = None
+            entry.children.clear()
+        if entry.keys is None or refresh or entry.size != len(node):
+            entry.keys = sorted(dict.keys(node) if isinstance(node, dict) else node)
+            entry.size = len(entry.keys)
+        return entry.keys
+
+    def _ordered_children(self, node, path, start, end):
+        """
+        Yield the keys of `node` that can lead to leaves in `[start, end)`,
+        in sorted order. A cached key missing from `node` means the node was
+        changed in place, so the keys are sorted again and the scan resumes
+        after the last key yielded.
+        """
+        d = len(path)
+        keys = self._sorted_children(node, path)
+        last = None
+        while True:
+            lo = 0
+            hi = len(keys)
+            if start is not None and len(start) > d and start[:d] == path:
+                lo = bisect_left(keys, start[d])
+            if end is not None and len(end) > d and end[:d] == path:
+                if len(end) == d + 1:
+                    hi = bisect_left(keys, end[d])
+                else:
+                    hi = bisect_right(keys, end[d])
+            if last is not None:
+                lo = max(lo, bisect_right(keys, last))
+            for i in range(lo, hi):
+                k = keys[i]
+                if not _node_has(node, k):
+                    keys = self._sorted_children(node, path, refresh=True)
+                    break
+                yield k
+                last = k
+            else:
+                return
+
+    def _walk_leaves(self, node, path, ordered, start=None, end=None):
+        if ordered:
+            keys = self._ordered_children(node, path, start, end)
+        else:
+            keys = dict.keys(node) if isinstance(node, dict) else node
+        for k in keys:
+            v = _node_get(node, k)
+            p = path + (k,)
+            if _is_node(v) and v:
+                yield from self._walk_leaves(v, p, ordered, start, end)
+            elif (start is None or p >= start) and (end is None or p < end):
+                yield p, v
+
+    def iter_leaves(self, prefix=None, sorted=False):
+        """
+        Yield `(dotted_key, value)` for every leaf below `prefix`, or for the
+        whole tree when `prefix` is None. Only the subtree at `prefix` is
+        walked. With `sorted=True` keys are visited in order, the sorted
+        child keys of each node are cached until a write through this
+        NestedDict changes them. Inner dicts changed in place are detected
+        when their size changes or a cached key has gone, a change that
+        swaps one key for another before the scan reaches it may be missed.
+        Empty dicts are returned as leaves.
+
+        >>> a = NestedDict({"b.y": 2, "b.x": 1, "a": 0})
+        >>> list(a.iter_leaves("b", sorted=True))
+        [('b.x', 1), ('b.y', 2)]
+
+        :param prefix: a dotted key
+        :param sorted: visit child keys in sorted order
+        """
+        if prefix is None:
+            path = ()
+            node = self
+        else:
+            if not isinstance(prefix, str):
+                raise ValueError(f"{prefix} is not a string type")
+            path = tuple(prefix.split('.'))
+            node = self._get_nested(self, list(path))
+            if not (_is_node(node) and node):
+                yield prefix, node
+                return
+        for p, v in self._walk_leaves(node, path, sorted):
+            yield '.'.join(p), v
+
+    def items_range(self, start_path=None, end_path=None):
+        """
+        Yield `(dotted_key, value)` in sorted order for every leaf whose key
+        is at least `start_path` and less than `end_path`. Keys are compared
+        segment by segment, so "a" sorts before "a.b" and everything below
+        "a" sorts before "a0". Subtrees outside the range are not visited.
+        Either bound may be None.
+
+        >>> a = NestedDict({"LOGIN_TEXT": 1, "REGISTER_PAGE_TAGLINE": 2, "REGISTER_TEXT": 3})
+        >>> list(a.items_range("REGISTER_PAGE", "REGISTER_PAGF"))
+        [('REGISTER_PAGE_TAGLINE', 2)]
+        """
+        for bound in (start_path, end_path):
+            if bound is not None and not isinstance(bound, str):
+                raise ValueError(f"{bound} is not a string type")
+        start = None if start_path is None else tuple(start_path.split('.'))
+        end = None if end_path is None else tuple(end_path.split('.'))
+        for p, v in self._walk_leaves(self, (), True, start, end):
+            yield '.'.join(p), v
+
+    def view(self, prefix):
+        """
+        Return a live `NestedDictView` of the subtree at `prefix`. Dotted
+        keys used with the view are relative to `prefix` and every read and
+        write goes to this NestedDict, nothing is copied. Creating a view
+        only checks that `prefix` holds a dict, so views are cheap to make
+        on demand.
+
+        >>> a = NestedDict({"a.b.c": 1})
+        >>> v = a.view("a.b")
+        >>> v["d.e"] = 2
+        >>> a
+        {'a': {'b': {'c': 1, 'd': {'e': 2}}}}
+
+        :param prefix: a dotted key whose value is a dict
+        :return: a NestedDictView
+        """
+        if not isinstance(prefix, str):
+            raise ValueError(f"{prefix} is not a string type")
+        if not _is_node(self._get_nested(self, prefix.split('.'))):
+            raise ValueError(f"{prefix} is not a dict")
+        return NestedDictView(self, prefix)
+
+    def _get_memo(self):
+        if self._memo is None:
+            self._memo = Memo(MEMO_MAXSIZE)
+        return self._memo
+
+    def derive(self, name, func, depends_on):
+        """
+        Register a derived value `name` computed as `func(self)`. The value
+        is computed on first access through `derived(name)`, cached, and
+        dropped whenever a key in `depends_on`, or a key above or below one
+        of them, is written through this NestedDict. Changes made directly
+        to an inner dict, as in `a["db"]["host"] = ...`, are not seen, write
+        `a["db.host"] = ...` instead. At most `MEMO_MAXSIZE` derived values
+        are cached (see `set_memo_maxsize`), the least recently used is
+        evicted first.
+
+        >>> a = NestedDict({"db.host": "localhost", "db.port": 5432})
+        >>> a.derive("url", lambda d: f"db://{d['db.host']}", ["db.host"])
+        >>> a.derived("url")
+        'db://localhost'
+        >>> a["db.host"] = "example.com"
+        >>> a.derived("url")
+        'db://example.com'
+
+        :param name: the name of the derived value
+        :param func: a function taking this NestedDict
+        :param depends_on: an iterable of dotted keys `func` reads
+        """
+        depends_on = list(depends_on)
+        for key in depends_on:
+            if not isinstance(key, str):
+                raise ValueError(f"{key} is not a string type")
+        self._get_memo().define(name, func, depends_on)
+
+    def derive_template(self, name, template):
+        """
+        Register a derived value `name` that is `template` with every
+        `${dotted.key}` replaced by the value of that key, see `interpolate`.
+        The keys referenced, including those reached through nested
+        templates, are tracked as its dependencies.
+
+        >>> a = NestedDict({"db.host": "localhost", "db.port": 5432})
+        >>> a.derive_template("address", "${db.host}:${db.port}")
+        >>> a.derived("address")
+        'localhost:5432'
+        """
+        if not isinstance(template, str):
+            raise ValueError(f"{template} is not a string type")
+        self._get_memo().define(name, template, [])
+
+    def derived(self, name):
+        """
+        Return the derived value `name`, computing it if it is not cached.
+        A cached value is returned as is when its dependencies were changed
+        directly in an inner dict rather than through this NestedDict.
+        Raises KeyError if `name` has not been registered and ValueError if
+        computing it requires its own value.
+        """
+        memo = self._memo
+        if memo is None:
+            raise KeyError(f"no such derived value: {name}")
+        return memo.get(self, name)
+
+    def set_memo_maxsize(self, maxsize):
+        """
+        Set the number of derived values this NestedDict caches, evicting
+        the least recently used if there are more. The default is
+        `MEMO_MAXSIZE`.
+        """
+        if not isinstance(maxsize, int) or maxsize < 0:
+            raise ValueError(f"{maxsize} is not a non-negative int")
+        self._get_memo().resize(maxsize)
+
+    def memo_info(self):
+        """
+        :return: a dict with the "hits", "misses", "size" and "maxsize" of
+            the derived value cache
+        """
+        memo = self._get_memo()
+        return {"hits": memo.hits, "misses": memo.misses,
+                "size": len(memo.cache), "maxsize": memo.maxsize}
+
+    def interpolate(self, template):
+        """
+        Return `template` with every `${dotted.key}` replaced by the value
+        of that key. String values that contain references are interpolated
+        in turn. A key that refers back to itself raises ValueError.
+
+        >>> a = NestedDict({"host": "localhost", "url": "http://${host}/"})
+        >>> a.interpolate("go to ${url}")
+        'go to http://localhost/'
+        """
+        return self._interpolate(template, (), set())
+
+    def _interpolate(self, template, stack, keys):
+        def replace(match):
+            key = match.group(1)
+            if key in stack:
+                raise ValueError(f"cycle in template: {' -> '.join(stack + (key,))}")
+            keys.add(key)
+            value = self[key]
+            if isinstance(value, str) and "${" in value:
+                value = self._interpolate(value, stack + (key,), keys)
+            return str(value)
+        return _TEMPLATE_REFERENCE.sub(replace, template)
+
+    @classmethod
+    def from_flat(cls, mapping, processes=None, threshold=None):
+        """
+        Build a NestedDict from a large flat mapping of dotted keys. Inputs
+        with at least `threshold` keys (default `PARALLEL_THRESHOLD`) are
+        partitioned by their first key segment and each partition is built
+        in a separate process. Smaller inputs are built in this process,
+        reusing the parent path of the previous key, which is fastest when
+        keys sharing a prefix are adjacent.
+
+        The result is the same as `NestedDict(mapping)` except that values
+        built in other processes are copies rather than the original objects.
+
+        >>> NestedDict.from_flat({"a.b": 1, "a.c": 2, "d": 3})
+        {'a': {'b': 1, 'c': 2}, 'd': 3}
+
+        :param mapping: a dict or a list of (key, value) pairs
+        :param processes: the number of worker processes, default os.cpu_count()
+        :param threshold: the number of keys at which to use worker processes
+        :return: a NestedDict
+        """
+        if cls._set_nested is not NestedDict._set_nested:
+            return cls(mapping)
+        items = list(mapping.items()) if isinstance(mapping, dict) else list(mapping)
+        if threshold is None:
+            threshold = PARALLEL_THRESHOLD
+        if processes is None:
+            processes = os.cpu_count() or 1
+        r = cls()
+        if len(items) < threshold or processes < 2:
+            _build_tree(items, r)
+            return r
+
+        partitions = {}
+        for item in items:
+            key = item[0]
+            if not isinstance(key, str):
+                raise ValueError(f"{key} is not a string type")
+            partitions.setdefault(key.partition('.')[0], []).append(item)
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            for top, tree in zip(partitions, executor.map(_build_tree, partitions.values())):
+                dict.__setitem__(r, top, dict.__getitem__(tree, top))
+        return r
+
+    @staticmethod
+    def compile_schema(paths, types=None, defaults=None):
+        """
+        Compile a fixed set of dotted keys into a `CompiledSchema` that
+        extracts all of them from a document in one pass.
+
+        >>> schema = NestedDict.compile_schema(["a.b", "a.c"], types={"a.b": int})
+        >>> schema(NestedDict({"a.b": 1, "a.c": "x"}))
+        Record(a_b=1, a_c='x')
+        >>> schema(NestedDict({"a.b": "1", "a.c": "x"}))
+        Traceback (most recent call last):
+        TypeError: a.b: expected <class 'int'>, got str
+
+        :param paths: an iterable of dotted keys
+        :param types: optional dict mapping keys to expected types
+        :param defaults: optional dict mapping keys to default values
+        :return: a CompiledSchema
+        """
+        return CompiledSchema(paths, types=types, defaults=defaults)
+
     def update(self, E=None, **F):  # known special case of dict.update
         """
         `D.update([E, ]**F) -> None`.  Update D from dict/iterable E and F.
@@ -236,6 +729,588 @@ class NestedDict(dict):
         """
         return self._apply_init(E, **F)
 
+    def __ior__(self, other):
+        """`D |= other`, the same as `D.update(other)`"""
+        self._apply_init(other)
+        return self
+
+    def setdefault(self, key, default_value=None):
+        """Return key if present, otherwise set key to `default_value` and
+        return it. Key may be dotted"""
+        if not isinstance(key, str):
+            raise ValueError(f"{key} is not a string type")
+        try:
+            return self._get_nested(self, key.split('.'))
+        except KeyError:
+            self[key] = default_value
+            return default_value
+
+    def clear(self):
+        """Remove all items"""
+        dict.clear(self)
+        self._invalidate()
+
+    def instrument(self, callback=None):
+        """
+        Start collecting access statistics for this instance. The instance
+        is switched to an instrumented subclass so uninstrumented instances
+        pay nothing. `callback`, if given, is called as
+        `callback(method, key, depth, elapsed_ns)` after every recorded call.
+
+        >>> a = NestedDict({"a.b": 1}).instrument()
+        >>> a["a.b"]
+        1
+        >>> a.stats()["paths"]
+        {'a.b': 1}
+        >>> a.uninstrument()
+        {'a': {'b': 1}}
+
+        :return: self
+        """
+        if not isinstance(self, _Instrumented):
+            self.__class__ = _instrumented_class(type(self))
+        self._instrumentation = Instrumentation(callback)
+        return self
+
+    def uninstrument(self):
+        """Stop collecting statistics and restore the original class. Returns self"""
+        if isinstance(self, _Instrumented):
+            self.__class__ = type(self).__bases__[1]
+            del self._instrumentation
+        return self
+
+    def stats(self):
+        """
+        Return a snapshot of the statistics collected since `instrument()`
+        was called, see `Instrumentation.snapshot`.
+        """
+        if not isinstance(self, _Instrumented):
+            raise ValueError("instrumentation is not enabled, call instrument() first")
+        return self._instrumentation.snapshot()
+
+
+class NestedDictView(MutableMapping):
+    """
+    A live view of the subtree of a NestedDict at a dotted prefix, created
+    by `NestedDict.view`. Keys are relative to the prefix and may be dotted.
+    All operations are forwarded to the parent NestedDict with the prefix
+    prepended, so writes through the view are seen by the parent and the
+    view sees every change made through the parent.
+    """
+
+    __slots__ = ("_parent", "_prefix", "_dotted")
+
+    def __init__(self, parent, prefix):
+        self._parent = parent
+        self._prefix = prefix
+        self._dotted = prefix + '.'
+
+    @property
+    def prefix(self):
+        """The dotted key of this view's root in the parent"""
+        return self._prefix
+
+    def _key(self, key):
+        if not isinstance(key, str):
+            raise ValueError(f"{key} is not a string type")
+        return self._dotted + key
+
+    def _node(self):
+        return self._parent[self._prefix]
+
+    def __getitem__(self, key):
+        return self._parent[self._key(key)]
+
+    def __setitem__(self, key, value):
+        self._parent[self._key(key)] = value
+
+    def __delitem__(self, key):
+        del self._parent[self._key(key)]
+
+    def __contains__(self, key):
+        return self._key(key) in self._parent
+
+    def __iter__(self):
+        return iter(list(self._node()))
+
+    def __len__(self):
+        return len(self._node())
+
+    def __repr__(self):
+        return repr(self._node())
+
+    def has_key(self, key):
+        """key in self"""
+        return self.__contains__(key)
+
+    def view(self, prefix):
+        """Return a view of the subtree at `prefix` relative to this view"""
+        return self._parent.view(self._key(prefix))
+
+    def iter_leaves(self, prefix=None, sorted=False):
+        """`NestedDict.iter_leaves` with keys relative to this view"""
+        full = self._prefix if prefix is None else self._key(prefix)
+        n = len(self._dotted)
+        for k, v in self._parent.iter_leaves(full, sorted=sorted):
+            yield k[n:], v
+
+    def items_range(self, start_path=None, end_path=None):
+        """`NestedDict.items_range` with keys relative to this view"""
+        path = tuple(self._prefix.split('.'))
+        start = None if start_path is None else tuple(self._key(start_path).split('.'))
+        end = None if end_path is None else tuple(self._key(end_path).split('.'))
+        n = len(self._dotted)
+        for p, v in self._parent._walk_leaves(self._node(), path, True, start, end):
+            yield '.'.join(p)[n:], v
+
+
+def _build_tree(items, root=None):
+    """
+    Insert `(dotted_key, value)` pairs into `root` with the same semantics
+    as `NestedDict._set_nested`. The nodes along the previous key's parent
+    path are kept so a key sharing that prefix only walks the new segments.
+    This is a module level function so it can run in a worker process.
+    """
+    if root is None:
+        root = {}
+    prev_parents = []
+    nodes = [root]
+    for key, value in items:
+        if not isinstance(key, str):
+            raise ValueError(f"{key} is not a string type")
+        keys = key.split('.')
+        parents = keys[:-1]
+        shared = 0
+        for a, b in zip(parents, prev_parents):
+            if a != b:
+                break
+            shared = shared + 1
+        del nodes[shared + 1:]
+        node = nodes[shared]
+        for k in parents[shared:]:
+            child = dict.get(node, k)
+            if not isinstance(child, dict):
+                child = {}
+                dict.__setitem__(node, k, child)
+            nodes.append(child)
+            node = child
+        dict.__setitem__(node, keys[-1], value)
+        prev_parents = parents
+    return root
+
+
+class _SortCache:
+    """Cached sorted child keys for one node, plus entries for its children"""
+
+    __slots__ = ("node", "keys", "size", "children")
+
+    def __init__(self):
+        self.node = None
+        self.keys = None
+        self.size = 0
+        self.children = {}
+
+
+class _DepNode:
+    """One segment of the dotted keys in a `Memo` dependency index"""
+
+    __slots__ = ("names", "children")
+
+    def __init__(self):
+        self.names = set()
+        self.children = {}
+
+
+class Memo:
+    """
+    The derived value cache of a NestedDict. `definitions` maps each name
+    to a function or template string, `cache` holds computed values in
+    least recently used order and `index` is a tree of key segments
+    recording which names depend on which dotted keys.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.definitions = {}
+        self.cache = OrderedDict()
+        self.index = _DepNode()
+        self.computing = set()
+        self.hits = 0
+        self.misses = 0
+
+    def define(self, name, definition, depends_on):
+        self.definitions[name] = definition
+        self.cache.pop(name, None)
+        for key in depends_on:
+            self.add_dependency(name, key)
+
+    def add_dependency(self, name, key):
+        node = self.index
+        for k in key.split('.'):
+            child = node.children.get(k)
+            if child is None:
+                child = node.children[k] = _DepNode()
+            node = child
+        node.names.add(name)
+
+    def invalidate(self, keys):
+        """
+        Drop every cached value depending on the key `keys`, on a key above
+        it or on a key below it.
+        """
+        if not self.cache:
+            return
+        node = self.index
+        cache = self.cache
+        for k in keys:
+            for name in node.names:
+                cache.pop(name, None)
+            node = node.children.get(k)
+            if node is None:
+                return
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            for name in node.names:
+                cache.pop(name, None)
+            stack.extend(node.children.values())
+
+    def clear(self):
+        self.cache.clear()
+
+    def resize(self, maxsize):
+        self.maxsize = maxsize
+        while len(self.cache) > maxsize:
+            self.cache.popitem(last=False)
+
+    def get(self, d, name):
+        cache = self.cache
+        if name in cache:
+            cache.move_to_end(name)
+            self.hits = self.hits + 1
+            return cache[name]
+        if name not in self.definitions:
+            raise KeyError(f"no such derived value: {name}")
+        if name in self.computing:
+            raise ValueError(f"cycle computing derived value: {name}")
+        self.misses = self.misses + 1
+        definition = self.definitions[name]
+        self.computing.add(name)
+        try:
+            if isinstance(definition, str):
+                keys = set()
+                value = d._interpolate(definition, (), keys)
+                for key in keys:
+                    self.add_dependency(name, key)
+            else:
+                value = definition(d)
+        finally:
+            self.computing.discard(name)
+        cache[name] = value
+        while len(cache) > self.maxsize:
+            cache.popitem(last=False)
+        return value
+
+
+class Instrumentation:
+    """
+    Access statistics for an instrumented NestedDict: a count of accesses
+    per dotted key, a count of lookups per traversal depth and a latency
+    histogram per method. Latencies are bucketed by powers of two
+    nanoseconds, a bucket labelled `n` holds calls that took less than `n` ns.
+    """
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.paths = Counter()
+        self.depths = Counter()
+        self.latency = {}
+
+    def record(self, method, key, elapsed_ns):
+        if key is None:
+            depth = 0
+        else:
+            self.paths[key] += 1
+            depth = key.count('.') + 1
+            self.depths[depth] += 1
+        histogram = self.latency.get(method)
+        if histogram is None:
+            histogram = self.latency[method] = Counter()
+        histogram[1 << elapsed_ns.bit_length()] += 1
+        if self.callback is not None:
+            self.callback(method, key, depth, elapsed_ns)
+
+    def snapshot(self):
+        """
+        :return: a dict with "paths", "depths" and "latency" entries. Latency
+            maps each method name to a `{bucket_ns: count}` dict.
+        """
+        return {
+            "paths": dict(self.paths),
+            "depths": dict(self.depths),
+            "latency": {method: dict(sorted(histogram.items()))
+                        for method, histogram in self.latency.items()},
+        }
+
+
+class _Instrumented:
+    """Marker base for the classes created by `_instrumented_class`"""
+
+
+_instrumented_classes = {}
+
+
+def _instrumented_class(cls):
+    """
+    Return a subclass of `cls` whose `__getitem__`, `get`, `__contains__`,
+    `__setitem__` and `_apply_init` record timings in `self._instrumentation`.
+    Instances pickle as plain `cls` objects without their statistics.
+    """
+    if cls in _instrumented_classes:
+        return _instrumented_classes[cls]
+
+    clock = time.perf_counter_ns
+    base_getitem = cls.__getitem__
+    base_get = cls.get
+    base_contains = cls.__contains__
+    base_setitem = cls.__setitem__
+    base_apply_init = cls._apply_init
+
+    def __getitem__(self, key):
+        start = clock()
+        try:
+            return base_getitem(self, key)
+        finally:
+            self._instrumentation.record("__getitem__",
+                                         key if isinstance(key, str) else None,
+                                         clock() - start)
+
+    def get(self, key, default_value=None):
+        start = clock()
+        try:
+            return base_get(self, key, default_value)
+        finally:
+            self._instrumentation.record("get",
+                                         key if isinstance(key, str) else None,
+                                         clock() - start)
+
+    def __contains__(self, key):
+        start = clock()
+        try:
+            return base_contains(self, key)
+        finally:
+            self._instrumentation.record("__contains__",
+                                         key if isinstance(key, str) else None,
+                                         clock() - start)
+
+    def __setitem__(self, key, value):
+        start = clock()
+        try:
+            base_setitem(self, key, value)
+        finally:
+            self._instrumentation.record("__setitem__",
+                                         key if isinstance(key, str) else None,
+                                         clock() - start)
+
+    def _apply_init(self, seq, **kwargs):
+        start = clock()
+        try:
+            return base_apply_init(self, seq, **kwargs)
+        finally:
+            self._instrumentation.record("_apply_init", None, clock() - start)
+
+    def __reduce__(self):
+        return cls, (dict.copy(self),)
+
+    instrumented = type(f"Instrumented{cls.__name__}", (_Instrumented, cls), {
+        "__getitem__": __getitem__,
+        "get": get,
+        "__contains__": __contains__,
+        "__setitem__": __setitem__,
+        "_apply_init": _apply_init,
+        "__reduce__": __reduce__,
+        "__module__": cls.__module__,
+    })
+    _instrumented_classes[cls] = instrumented
+    return instrumented
+
+
+class _SmallNode(Mapping):
+    """
+    A read-only mapping holding up to `MAX_CHILDREN` entries in two tuples.
+    Used by `CompactNestedDict` for intermediate levels in place of `{}`.
+    The keys tuple is shared between sibling nodes with the same shape.
+    """
+
+    __slots__ = ("_keys", "_values")
+
+    MAX_CHILDREN = 4
+
+    def __init__(self, keys=(), values=()):
+        self._keys = keys
+        self._values = values
+
+    def __getitem__(self, key):
+        try:
+            return self._values[self._keys.index(key)]
+        except ValueError:
+            raise KeyError(key) from None
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __repr__(self):
+        return repr(dict(zip(self._keys, self._values)))
+
+
+def _is_node(d):
+    return isinstance(d, (dict, _SmallNode))
+
+
+def _node_has(node, key):
+    if isinstance(node, dict):
+        return dict.__contains__(node, key)
+    return key in node._keys
+
+
+def _node_get(node, key):
+    if isinstance(node, dict):
+        return dict.__getitem__(node, key)
+    return node[key]
+
+
+class CompactNestedDict(NestedDict):
+    """
+    A NestedDict that trades some lookup speed for a smaller memory
+    footprint on large, sparse trees. Intermediate levels created by
+    dotted keys are stored as `_SmallNode` objects until they grow past
+    four children, at which point they are upgraded to a plain `dict`.
+    Key segments are interned, and after construction (or a call to
+    `share_keys()`) nodes with identical key sets share a single key tuple.
+
+    >>> a = CompactNestedDict({"a.b.c": 1, "a.b.d": 2})
+    >>> a
+    {'a': {'b': {'c': 1, 'd': 2}}}
+    >>> a["a.b.d"]
+    2
+    >>> a["a.b"] == {"c": 1, "d": 2}
+    True
+
+    This helps most on record-shaped trees: many intermediate levels with
+    four or fewer children whose key names repeat. It stops helping on wide
+    trees with unique key names, where nodes become dicts anyway and each
+    distinct name adds an entry to the interpreter's intern table.
+
+    Nested values are `Mapping` objects rather than `dict`, use `to_dict()`
+    before passing the tree to code that requires real dicts such as
+    `json.dumps`. Dicts assigned as values are stored as given.
+    """
+
+    def __init__(self, seq=None, **kwargs):
+        super().__init__(seq, **kwargs)
+        self.share_keys()
+
+    def share_keys(self):
+        """
+        Make every small node whose key set matches another's use the same
+        key tuple. Only the shapes of live nodes are kept, the table used
+        to find them is discarded afterwards. Called by the constructor,
+        call it again after bulk updates or inserts.
+        """
+        table = {}
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, _SmallNode):
+                node._keys = table.setdefault(node._keys, node._keys)
+                values = node._values
+            else:
+                values = dict.values(node)
+            stack.extend(v for v in values if _is_node(v))
+
+    def _has_nested(self, d, keys):
+        for k in keys[:-1]:
+            if not _is_node(d) or not _node_has(d, k):
+                return False
+            d = _node_get(d, k)
+        return _is_node(d) and _node_has(d, keys[-1])
+
+    def _get_nested(self, d, keys):
+        for k in keys[:-1]:
+            if not _is_node(d) or not _node_has(d, k):
+                raise KeyError(f"no such key: {k}")
+            d = _node_get(d, k)
+        if not _is_node(d):
+            raise KeyError(f"no such key: {keys[-1]}")
+        return _node_get(d, keys[-1])
+
+    def _node_set(self, node, key, value):
+        """
+        Set `key` in `node` and return the node that should replace it in
+        its parent (a different object when a small node is upgraded).
+        """
+        if isinstance(node, dict):
+            dict.__setitem__(node, key, value)
+            return node
+        keys = node._keys
+        if key in keys:
+            i = keys.index(key)
+            node._values = node._values[:i] + (value,) + node._values[i + 1:]
+            return node
+        if len(keys) < _SmallNode.MAX_CHILDREN:
+            node._keys = keys + (key,)
+            node._values = node._values + (value,)
+            return node
+        upgraded = dict(zip(keys, node._values))
+        upgraded[key] = value
+        return upgraded
+
+    def _set_nested(self, d, keys, value):
+        key = sys.intern(keys[0])
+        if len(keys) > 1:
+            child = _node_get(d, key) if _node_has(d, key) else None
+            if _is_node(child):
+                new_child = self._set_nested(child, keys[1:], value)
+                if new_child is child:
+                    return d
+            else:
+                new_child = self._set_nested(_SmallNode(), keys[1:], value)
+            return self._node_set(d, key, new_child)
+        return self._node_set(d, key, value)
+
+    def _del_nested(self, d, keys):
+        for k in keys[:-1]:
+            if not _is_node(d) or not _node_has(d, k):
+                raise KeyError(k)
+            d = _node_get(d, k)
+        key = keys[-1]
+        if isinstance(d, dict):
+            dict.__delitem__(d, key)
+            return
+        if not _is_node(d) or not _node_has(d, key):
+            raise KeyError(key)
+        i = d._keys.index(key)
+        d._keys = d._keys[:i] + d._keys[i + 1:]
+        d._values = d._values[:i] + d._values[i + 1:]
+
+    def to_dict(self):
+        """
+        Return a deep copy of the tree using plain dicts for every level.
+
+        >>> CompactNestedDict({"a.b": 1}).to_dict()
+        {'a': {'b': 1}}
+        """
+        def expand(node):
+            items = dict.items(node) if isinstance(node, dict) else node.items()
+            return {k: expand(v) if _is_node(v) else v for k, v in items}
+        return expand(self)
+
 
 if __name__ == "__main__":
     import doctest
@@ -0,0 +1,39 @@
+import unittest
+
+import benchmark
+from nesteddict import NestedDict
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def test_generate_document(self):
+        flat = benchmark.generate_document(depth=3, fanout=4, leaves=100)
+        self.assertEqual(len(flat), 100)
+        self.assertTrue(all(len(k.split('.')) == 3 for k in flat))
+        d = NestedDict(flat)
+        self.assertEqual(len(d), 4)
+
+    def test_run_benchmarks(self):
+        results = benchmark.run_benchmarks(["get", "memory_nesteddict"],
+                                           depth=2, fanout=2, leaves=10, repeat=1)
+        self.assertEqual(set(results["results"]), {"get", "memory_nesteddict"})
+        self.assertGreater(results["results"]["get"]["value"], 0)
+        self.assertRaises(ValueError, benchmark.run_benchmarks, ["nosuch"])
+
+    def test_compare_results(self):
+        baseline = {"results": {"get": {"value": 100, "unit": benchmark.HIGHER_IS_BETTER},
+                                "memory": {"value": 100, "unit": benchmark.LOWER_IS_BETTER}}}
+        current = {"results": {"get": {"value": 80, "unit": benchmark.HIGHER_IS_BETTER},
+                               "memory": {"value": 80, "unit": benchmark.LOWER_IS_BETTER},
+                               "new": {"value": 1, "unit": benchmark.HIGHER_IS_BETTER}}}
+        rows = {name: (change, regressed)
+                for name, _, _, change, regressed in benchmark.compare_results(baseline, current)}
+        self.assertEqual(set(rows), {"get", "memory"})
+        self.assertAlmostEqual(rows["get"][0], -0.2)
+        self.assertTrue(rows["get"][1])
+        self.assertAlmostEqual(rows["memory"][0], 0.2)
+        self.assertFalse(rows["memory"][1])
+
+
+if __name__ == '__main__':
+    unittest.main()
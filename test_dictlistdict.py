@@ -35,6 +35,73 @@ class TestDictListDict(unittest.TestCase):
         self.assertEqual(orig, gen)
 
 
+    def test_typed_values(self):
+        encoding = "Latin-1"
+        orig = {"a": {"int": 1, "float": -2.5, "t": True, "f": False, "n": None,
+                      "s": "say \"hi\"", "num_str": "42", "list": [1, "x"], "empty": {}}}
+        with open("typed.json", "w", encoding=encoding) as output_file:
+            json.dump(orig, output_file)
+
+        dictlistdict.json_to_text("typed.json", "typed.txt")
+        dictlistdict.text_to_json("typed.txt", "typed_new.json")
+        gen = loadJSON("typed_new.json", encoding)
+        self.assertEqual(orig, gen)
+        self.assertIsInstance(gen["a"]["int"], int)
+        self.assertIsInstance(gen["a"]["num_str"], str)
+        for name in ("typed.json", "typed.txt", "typed_new.json"):
+            os.unlink(name)
+
+    def test_dictlistdict_compress(self):
+        encoding = "Latin-1"
+
+        dictlistdict.json_to_text("small.json", "small.txt")
+        dictlistdict.json_to_text("small.json", "small_compressed.txt", compress=True)
+        dictlistdict.text_to_json("small_compressed.txt", "small_new.json", compress=True)
+        orig = loadJSON("small.json", encoding)
+        gen = loadJSON("small_new.json", encoding)
+        self.assertEqual(orig, gen)
+        self.assertLess(os.path.getsize("small_compressed.txt"), os.path.getsize("small.txt"))
+        os.unlink("small_compressed.txt")
+
+    def test_compress_dict(self):
+        d = {"aaaa": {"bb": {"cc": 1, "dd": {"ee": 2}}, "ff": 3}, "gg": {"hh": 4}}
+        lines = list(dictlistdict.compress_dict(d))
+        self.assertEqual(lines, ["aaaa.bb.cc=1", ".dd.ee=2", "...ff=3", "gg.hh=4"])
+        prev_parent = ()
+        leaves = []
+        for line in lines:
+            key, _, value = line.partition("=")
+            keys = dictlistdict.expand_key(key, prev_parent)
+            prev_parent = keys[:-1]
+            leaves.append(keys)
+        self.assertEqual(leaves, [list(k) for k, _ in dictlistdict.flatten_items(d)])
+        self.assertRaises(ValueError, dictlistdict.expand_key, "...x", ("a",))
+        self.assertRaises(ValueError, list, dictlistdict.compress_dict({"": {"a": 1}}))
+
+    def test_compress_empty_segment(self):
+        d = {"a": {"b": 1, "": {"x": 1}}}
+        lines = list(dictlistdict.compress_dict(d))
+        self.assertEqual(lines, ["a.b=1", "a..x=1"])
+        prev_parent = ()
+        leaves = []
+        for line in lines:
+            key, _, value = line.partition("=")
+            keys = dictlistdict.expand_key(key, prev_parent)
+            prev_parent = keys[:-1]
+            leaves.append(keys)
+        self.assertEqual(leaves, [["a", "b"], ["a", "", "x"]])
+
+    def test_read_text_interns_segments(self):
+        with open("interned.txt", "w", encoding="Latin-1") as output_file:
+            output_file.write("x.name_segment=1\ny.name_segment=2\n")
+        r = dictlistdict.read_text("interned.txt")
+        os.unlink("interned.txt")
+        self.assertEqual(r, {"x": {"name_segment": 1}, "y": {"name_segment": 2}})
+        self.assertIs(next(iter(r["x"])), next(iter(r["y"])))
+
+    def test_parse_value_legacy(self):
+        self.assertEqual(dictlistdict.parse_value('"Login"'), "Login")
+
     def test_dictlistdict(self):
         encoding = "Latin-1"
 
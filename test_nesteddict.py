@@ -7,7 +7,12 @@ Created on 3 May 2017
 
 import unittest
 
-from nesteddict import NestedDict
+import copy
+import json
+import pickle
+
+import nesteddict
+from nesteddict import NestedDict, CompactNestedDict
 
 
 class TestNestedDict(unittest.TestCase):
@@ -58,6 +63,7 @@ class TestNestedDict(unittest.TestCase):
         self.assertTrue("a" in x)
         self.assertFalse("z" in x)
         self.assertFalse("a.z" in x)
+        self.assertFalse("a.b.c" in x)
 
     def test_getitem(self):
         x = NestedDict({"a": {"b": 1}})
@@ -139,6 +145,380 @@ class TestNestedDict(unittest.TestCase):
         self.assertEqual(x['w'], 10)
         self.assertEqual(x['x'], 11)
 
+    def test_compile_schema(self):
+        x = NestedDict({"a.b.c": 1, "a.b.d": "s", "a.e": [1], "z": 2})
+        schema = NestedDict.compile_schema(["a.b.c", "a.b.d", "a.e", "a.b", "z"])
+        r = schema(x)
+        self.assertEqual(tuple(r), (1, "s", [1], {"c": 1, "d": "s"}, 2))
+        self.assertEqual(r.a_b_c, 1)
+        self.assertEqual(schema.paths, ("a.b.c", "a.b.d", "a.e", "a.b", "z"))
+
+        self.assertRaises(KeyError, schema, {"a": {"b": 1}, "z": 2})
+        self.assertRaises(KeyError, schema, {})
+
+        schema = NestedDict.compile_schema(["a.b.c", "q.r"], types={"a.b.c": int},
+                                           defaults={"q.r": None})
+        self.assertEqual(tuple(schema(x)), (1, None))
+        self.assertRaises(TypeError, schema, {"a": {"b": {"c": "1"}}})
+
+        self.assertRaises(ValueError, NestedDict.compile_schema, ["a", "a"])
+        self.assertRaises(ValueError, NestedDict.compile_schema, [1])
+        self.assertRaises(ValueError, NestedDict.compile_schema, ["a"], types={"b": int})
+
+    def test_from_flat(self):
+        flat = [("a.b.c", 1), ("a.b.d", 2), ("a.e", 3), ("x", 4), ("a.b", {"z": 1}),
+                ("a.b.y", 5), ("x.y", 6), ("q.r.s", 7)]
+        expected = NestedDict(flat)
+        x = NestedDict.from_flat(flat)
+        self.assertIsInstance(x, NestedDict)
+        self.assertEqual(x, expected)
+        self.assertEqual(NestedDict.from_flat(dict(flat)), NestedDict(dict(flat)))
+        x = NestedDict.from_flat(flat, processes=2, threshold=0)
+        self.assertEqual(x, expected)
+        self.assertEqual(list(x), list(expected))
+        self.assertRaises(ValueError, NestedDict.from_flat, [(1, 2)])
+        self.assertRaises(ValueError, NestedDict.from_flat, [(1, 2)], processes=2, threshold=0)
+        self.assertIsInstance(CompactNestedDict.from_flat(flat), CompactNestedDict)
+        self.assertEqual(CompactNestedDict.from_flat(flat), expected)
+
+    def test_iter_leaves(self):
+        x = NestedDict({"b.z": 3, "b.y.q": 2, "a": 1, "c": {}, "b.x": 0})
+        self.assertEqual(list(x.iter_leaves()),
+                         [("b.z", 3), ("b.y.q", 2), ("b.x", 0), ("a", 1), ("c", {})])
+        self.assertEqual(list(x.iter_leaves(sorted=True)),
+                         [("a", 1), ("b.x", 0), ("b.y.q", 2), ("b.z", 3), ("c", {})])
+        self.assertEqual(list(x.iter_leaves("b", sorted=True)),
+                         [("b.x", 0), ("b.y.q", 2), ("b.z", 3)])
+        self.assertEqual(list(x.iter_leaves("b.y.q")), [("b.y.q", 2)])
+        self.assertRaises(KeyError, list, x.iter_leaves("nosuch.key"))
+
+        x["b.w"] = 4
+        self.assertEqual([k for k, _ in x.iter_leaves("b", sorted=True)],
+                         ["b.w", "b.x", "b.y.q", "b.z"])
+        x["b.y.q"] = 5
+        x["b.y.p"] = 6
+        self.assertEqual(list(x.iter_leaves("b.y", sorted=True)), [("b.y.p", 6), ("b.y.q", 5)])
+        del x["b.w"]
+        x.pop("b.x")
+        self.assertEqual([k for k, _ in x.iter_leaves(sorted=True)],
+                         ["a", "b.y.p", "b.y.q", "b.z", "c"])
+        x["b"] = {"n": 1, "m": 2}
+        self.assertEqual(list(x.iter_leaves("b", sorted=True)), [("b.m", 2), ("b.n", 1)])
+        x.update({"aa.z": 1})
+        self.assertEqual([k for k, _ in x.iter_leaves(sorted=True)],
+                         ["a", "aa.z", "b.m", "b.n", "c"])
+
+    def test_sorted_cache_dict_methods(self):
+        x = NestedDict({"a": 1, "b": 2})
+        list(x.iter_leaves(sorted=True))
+        x.clear()
+        self.assertEqual(list(x.iter_leaves(sorted=True)), [])
+
+        x = NestedDict({"a": 1, "b": 2})
+        list(x.iter_leaves(sorted=True))
+        self.assertEqual(x.setdefault("c", 3), 3)
+        self.assertEqual(x.setdefault("a", 5), 1)
+        self.assertEqual(x.setdefault("d.e", 4), 4)
+        self.assertEqual(x["d"], {"e": 4})
+        self.assertEqual(list(x.iter_leaves(sorted=True)),
+                         [("a", 1), ("b", 2), ("c", 3), ("d.e", 4)])
+
+        x |= {"aa.b": 6}
+        self.assertIsInstance(x, NestedDict)
+        self.assertEqual([k for k, _ in x.iter_leaves(sorted=True)],
+                         ["a", "aa.b", "b", "c", "d.e"])
+
+    def test_copy_and_pickle_drop_caches(self):
+        x = NestedDict({"db.host": "localhost", "b.y": 2, "b.x": 1})
+        x.derive("url", lambda d: f"db://{d['db.host']}", ["db.host"])
+        self.assertEqual(x.derived("url"), "db://localhost")
+        list(x.iter_leaves(sorted=True))
+        y = copy.copy(x)
+        self.assertEqual(y, x)
+        self.assertIsNone(y._memo)
+        self.assertIsNone(y._sort_cache)
+        y.derive("url", lambda d: d["db.host"], ["db.host"])
+        self.assertEqual(x.derived("url"), "db://localhost")
+        data = pickle.dumps(x)
+        self.assertEqual(len(data), len(pickle.dumps(NestedDict(x))))
+        z = pickle.loads(data)
+        self.assertEqual(z, x)
+        self.assertIsInstance(z, NestedDict)
+        self.assertRaises(KeyError, z.derived, "url")
+
+    def test_sorted_cache_inner_dict_changes(self):
+        x = NestedDict({"a": 1, "b.x": 1, "b.y": 2})
+        list(x.iter_leaves(sorted=True))
+        x["b"]["z"] = 3
+        self.assertEqual(list(x.iter_leaves(sorted=True)),
+                         [("a", 1), ("b.x", 1), ("b.y", 2), ("b.z", 3)])
+        del x["b"]["x"]
+        self.assertEqual(list(x.iter_leaves(sorted=True)),
+                         [("a", 1), ("b.y", 2), ("b.z", 3)])
+        list(x.items_range("b"))
+        del x["b"]["y"]
+        x["b"]["w"] = 4
+        self.assertEqual(list(x.items_range("b")), [("b.w", 4), ("b.z", 3)])
+
+    def test_items_range(self):
+        x = NestedDict({"a.b": 1, "a.c.d": 2, "a.c.e": 3, "a0": 4, "b.x": 5,
+                        "REGISTER_PAGE_TAGLINE": 6, "REGISTER_TEXT": 7})
+        self.assertEqual([k for k, _ in x.items_range()],
+                         ["REGISTER_PAGE_TAGLINE", "REGISTER_TEXT", "a.b", "a.c.d", "a.c.e", "a0",
+                          "b.x"])
+        self.assertEqual([k for k, _ in x.items_range("a", "a0")], ["a.b", "a.c.d", "a.c.e"])
+        self.assertEqual([k for k, _ in x.items_range("a.c", "a.c.e")], ["a.c.d"])
+        self.assertEqual([k for k, _ in x.items_range("a.c.e")], ["a.c.e", "a0", "b.x"])
+        self.assertEqual([k for k, _ in x.items_range(None, "REGISTER_TEXT")],
+                         ["REGISTER_PAGE_TAGLINE"])
+        self.assertEqual(list(x.items_range("REGISTER_PAGE", "REGISTER_PAGF")),
+                         [("REGISTER_PAGE_TAGLINE", 6)])
+        self.assertEqual(list(x.items_range("z")), [])
+        self.assertRaises(ValueError, list, x.items_range(1))
+
+        y = CompactNestedDict({"b.y": 2, "b.x": 1})
+        self.assertEqual(list(y.items_range("b")), [("b.x", 1), ("b.y", 2)])
+
+    def test_view(self):
+        x = NestedDict({"a.b.c": 1, "a.b.d.e": 2, "z": 3})
+        v = x.view("a.b")
+        self.assertEqual(v.prefix, "a.b")
+        self.assertEqual(v["c"], 1)
+        self.assertEqual(v["d.e"], 2)
+        self.assertTrue("d.e" in v)
+        self.assertFalse("d.f" in v)
+        self.assertTrue(v.has_key("c"))
+        self.assertEqual(v.get("q", 5), 5)
+        self.assertEqual(len(v), 2)
+        self.assertEqual(sorted(v), ["c", "d"])
+        self.assertEqual(v, {"c": 1, "d": {"e": 2}})
+
+        v["d.f"] = 4
+        self.assertEqual(x["a.b.d.f"], 4)
+        del v["c"]
+        self.assertFalse("a.b.c" in x)
+        self.assertEqual(v.pop("d.f"), 4)
+        v.update({"g.h": 5})
+        self.assertEqual(x["a.b.g.h"], 5)
+        x["a.b.c"] = 6
+        self.assertEqual(v["c"], 6)
+
+        w = v.view("d")
+        self.assertEqual(w.prefix, "a.b.d")
+        self.assertEqual(dict(w), {"e": 2})
+        self.assertEqual(list(v.iter_leaves(sorted=True)), [("c", 6), ("d.e", 2), ("g.h", 5)])
+        self.assertEqual(list(v.iter_leaves("d")), [("d.e", 2)])
+        self.assertEqual(list(v.items_range("d", "g")), [("d.e", 2)])
+        self.assertEqual(list(v.items_range()), [("c", 6), ("d.e", 2), ("g.h", 5)])
+
+        x["a.b.g"] = 5
+        self.assertRaises(ValueError, x.view, "a.b.g")
+        self.assertRaises(KeyError, x.view, "nosuch")
+        self.assertRaises(ValueError, x.view, "z")
+        self.assertRaises(ValueError, v.__getitem__, 1)
+
+    def test_derive(self):
+        calls = []
+
+        def url(d):
+            calls.append(1)
+            return f"db://{d['db.host']}:{d['db.port']}"
+
+        x = NestedDict({"db.host": "localhost", "db.port": 5432, "other": 1})
+        self.assertRaises(KeyError, x.derived, "url")
+        x.derive("url", url, ["db.host", "db.port"])
+        self.assertEqual(x.derived("url"), "db://localhost:5432")
+        self.assertEqual(x.derived("url"), "db://localhost:5432")
+        self.assertEqual(len(calls), 1)
+        x["other"] = 2
+        x.derived("url")
+        self.assertEqual(len(calls), 1)
+
+        x["db.port"] = 1
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(x.derived("url"), "db://localhost:1")
+        self.assertEqual(len(calls), 2)
+        x["db"] = {"host": "h", "port": 2}
+        self.assertEqual(x.derived("url"), "db://h:2")
+        x.view("db")["port"] = 3
+        self.assertEqual(x.derived("url"), "db://h:3")
+        del x["db.port"]
+        self.assertRaises(KeyError, x.derived, "url")
+        x.update({"db.port": 4})
+        self.assertEqual(x.derived("url"), "db://h:4")
+        self.assertEqual(x.memo_info()["misses"], len(calls))
+        self.assertRaises(KeyError, x.derived, "nosuch")
+        self.assertRaises(ValueError, x.derive, "bad", url, [1])
+
+    def test_derive_lru(self):
+        x = NestedDict({"a": 1})
+        for i in range(nesteddict.MEMO_MAXSIZE + 1):
+            x.derive(f"v{i}", lambda d, i=i: d["a"] + i, ["a"])
+            x.derived(f"v{i}")
+        info = x.memo_info()
+        self.assertEqual(info["size"], nesteddict.MEMO_MAXSIZE)
+        x.derived("v0")
+        self.assertEqual(x.memo_info()["misses"], info["misses"] + 1)
+
+    def test_derive_dict_methods(self):
+        x = NestedDict({"h": "x"})
+        x.derive_template("u", "${h}")
+        self.assertEqual(x.derived("u"), "x")
+        x |= {"h": "y"}
+        self.assertEqual(x.derived("u"), "y")
+        x.clear()
+        self.assertRaises(KeyError, x.derived, "u")
+        x.setdefault("h", "z")
+        self.assertEqual(x.derived("u"), "z")
+
+    def test_memo_maxsize(self):
+        x = NestedDict({"a": 1})
+        y = NestedDict({"a": 1})
+        for i in range(4):
+            x.derive(f"v{i}", lambda d, i=i: d["a"] + i, ["a"])
+            x.derived(f"v{i}")
+        x.set_memo_maxsize(2)
+        self.assertEqual(x.memo_info()["size"], 2)
+        self.assertEqual(x.memo_info()["maxsize"], 2)
+        self.assertEqual(y.memo_info()["maxsize"], nesteddict.MEMO_MAXSIZE)
+        x.set_memo_maxsize(0)
+        x.derived("v0")
+        self.assertEqual(x.memo_info()["size"], 0)
+        self.assertRaises(ValueError, x.set_memo_maxsize, -1)
+
+    def test_derive_template(self):
+        x = NestedDict({"db.host": "localhost", "db.port": 5432,
+                        "url": "http://${db.host}:${db.port}/", "a": "${b}", "b": "${a}"})
+        self.assertEqual(x.interpolate("${db.host}:${db.port}"), "localhost:5432")
+        x.derive_template("link", "<${url}>")
+        self.assertEqual(x.derived("link"), "<http://localhost:5432/>")
+        x["db.port"] = 1
+        self.assertEqual(x.derived("link"), "<http://localhost:1/>")
+        x["url"] = "ftp://${db.host}"
+        self.assertEqual(x.derived("link"), "<ftp://localhost>")
+
+        self.assertRaises(ValueError, x.interpolate, "${a}")
+        x.derive_template("loop", "${a}")
+        self.assertRaises(ValueError, x.derived, "loop")
+        self.assertRaises(KeyError, x.interpolate, "${nosuch}")
+
+        x.derive("self", lambda d: d.derived("self"), [])
+        self.assertRaises(ValueError, x.derived, "self")
+
+    def test_instrument(self):
+        events = []
+        x = NestedDict({"a": {"b": 1}})
+        self.assertRaises(ValueError, x.stats)
+        self.assertIs(x.instrument(lambda *args: events.append(args)), x)
+        self.assertIsInstance(x, NestedDict)
+        x['a.b']
+        x['a.b']
+        x['c'] = 2
+        x.update({"d.e": 3})
+        self.assertRaises(KeyError, x.__getitem__, "z.y.x")
+        stats = x.stats()
+        self.assertEqual(stats["paths"], {"a.b": 2, "c": 1, "z.y.x": 1})
+        self.assertEqual(stats["depths"], {1: 1, 2: 2, 3: 1})
+        self.assertEqual(sum(stats["latency"]["__getitem__"].values()), 3)
+        self.assertEqual(sum(stats["latency"]["__setitem__"].values()), 1)
+        self.assertEqual(sum(stats["latency"]["_apply_init"].values()), 1)
+        self.assertEqual(len(events), 5)
+        self.assertEqual(events[0][:3], ("__getitem__", "a.b", 2))
+
+        x.uninstrument()
+        self.assertIs(type(x), NestedDict)
+        self.assertEqual(x['d.e'], 3)
+        self.assertRaises(ValueError, x.stats)
+
+        x.instrument()
+        self.assertEqual(x.get("a.b"), 1)
+        self.assertTrue("d.e" in x)
+        self.assertFalse("d.q" in x)
+        stats = x.stats()
+        self.assertEqual(stats["paths"], {"a.b": 1, "d.e": 1, "d.q": 1})
+        self.assertEqual(sum(stats["latency"]["get"].values()), 1)
+        self.assertEqual(sum(stats["latency"]["__contains__"].values()), 2)
+
+        copy = pickle.loads(pickle.dumps(x))
+        self.assertIs(type(copy), NestedDict)
+        self.assertEqual(copy, x)
+        x.uninstrument()
+
+        y = CompactNestedDict({"a.b": 1}).instrument()
+        copy = pickle.loads(pickle.dumps(y))
+        self.assertIs(type(copy), CompactNestedDict)
+        self.assertEqual(copy["a.b"], 1)
+        self.assertIsInstance(y, CompactNestedDict)
+        self.assertEqual(y['a.b'], 1)
+        self.assertIs(type(y.uninstrument()), CompactNestedDict)
+
+
+class TestCompactNestedDict(unittest.TestCase):
+
+    def test_compact(self):
+        x = CompactNestedDict({'a.b.c': 1, 'x.y.z': 2}, m=5)
+        self.assertEqual(x['a.b.c'], 1)
+        self.assertEqual(x['x.y'], {'z': 2})
+        self.assertEqual(x['m'], 5)
+        self.assertTrue('a.b' in x)
+        self.assertFalse('a.b.z' in x)
+        self.assertFalse('m.n' in x)
+        self.assertRaises(KeyError, x.__getitem__, "a.q.c")
+        self.assertEqual(x.get('a.q', 3), 3)
+
+        x['a.b.c'] = 10
+        x['a.b.c.d'] = 11
+        self.assertEqual(x['a.b.c'], {'d': 11})
+        self.assertEqual(x.pop('x.y.z'), 2)
+        self.assertEqual(x['x.y'], {})
+        self.assertRaises(KeyError, x.__delitem__, "x.y.z")
+        del x['x']
+        self.assertFalse('x' in x)
+
+        self.assertRaises(KeyError, x.__getitem__, 'm.n')
+        self.assertRaises(KeyError, x.__delitem__, 'm.n')
+        self.assertRaises(KeyError, x.__getitem__, 'a.b.c.d.e')
+        self.assertRaises(KeyError, x.__delitem__, 'a.b.c.d.e')
+        self.assertEqual(x.get('m.n', 1), 1)
+
+    def test_upgrade(self):
+        x = CompactNestedDict()
+        for i in range(10):
+            x[f'a.k{i}'] = i
+        self.assertIsInstance(dict.__getitem__(x, 'a'), dict)
+        self.assertEqual(x['a.k9'], 9)
+        self.assertEqual(len(x['a']), 10)
+
+    def test_shared_keys(self):
+        x = CompactNestedDict({f'r{i}.{k}': i for i in range(3) for k in ("name", "age")})
+        self.assertIs(dict.__getitem__(x, 'r0')._keys, dict.__getitem__(x, 'r2')._keys)
+        x['r3.name'] = "n"
+        x['r3.age'] = 3
+        x.share_keys()
+        self.assertIs(dict.__getitem__(x, 'r0')._keys, dict.__getitem__(x, 'r3')._keys)
+
+    def test_no_shape_table(self):
+        x = CompactNestedDict()
+        for i in range(100):
+            x[f'a.b{i % 3}.k{i}'] = i
+        for i in range(100):
+            del x[f'a.b{i % 3}.k{i}']
+        self.assertEqual(x, {'a': {'b0': {}, 'b1': {}, 'b2': {}}})
+        self.assertEqual(vars(x), {})
+
+    def test_compile_schema(self):
+        x = CompactNestedDict({"a.b": 1, "a.c.d": "s"})
+        schema = NestedDict.compile_schema(["a.b", "a.c.d", "a.c"])
+        self.assertEqual(tuple(schema(x)), (1, "s", {"d": "s"}))
+        self.assertRaises(KeyError, NestedDict.compile_schema(["a.q"]), x)
+
+    def test_to_dict(self):
+        flat = {'a.b.c': 1, 'a.b.d': [1, 2], 'x': "s"}
+        self.assertEqual(CompactNestedDict(flat).to_dict(), NestedDict(flat))
+        self.assertEqual(json.loads(json.dumps(CompactNestedDict(flat).to_dict())),
+                         NestedDict(flat))
+
+
 if __name__ == "__main__":
     #import sys;sys.argv = ['', 'Test.testName']
     unittest.main()